@@ -1,14 +1,31 @@
+import asyncio
 import os
-import json
-from datetime import datetime
-
+import re
+import sys
+import threading
+import time
+import traceback
+from datetime import datetime, timezone
+from xml.sax.saxutils import escape
+
+import orjson
 from fastapi import FastAPI, Request
 from fastapi.responses import Response
-from twilio.twiml.messaging_response import MessagingResponse
 from dotenv import load_dotenv
+from aiolimiter import AsyncLimiter
 
+import httplib2
 from google.oauth2 import service_account
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
+from tenacity import (
+    retry,
+    retry_if_exception,
+    stop_after_attempt,
+    wait_exponential_jitter,
+)
 
 load_dotenv()
 
@@ -20,65 +37,208 @@ SERVICE_ACCOUNT_JSON = os.getenv("GOOGLE_SERVICE_ACCOUNT_JSON")
 TIMEZONE = os.getenv("TIMEZONE", "UTC")
 
 
+def _int_env(name, default):
+    try:
+        return int(os.getenv(name, "") or default)
+    except ValueError:
+        return default
+
+
+# Business config lives in env vars (same pattern as SPREADSHEET_ID): it is
+# a handful of values that change rarely, so reading it from the
+# BusinessConfig sheet on every refresh was a Sheets call we never needed.
+CONFIG = {
+    "business_name": os.getenv("BUSINESS_NAME", ""),
+    "order_mode": os.getenv("ORDER_MODE", "").strip().lower(),  # pickup / delivery / both
+    "currency_symbol": os.getenv("CURRENCY_SYMBOL", "$"),
+    "hours": os.getenv("HOURS", ""),
+    "address": os.getenv("ADDRESS", ""),
+    "menu_page_size": _int_env("MENU_PAGE_SIZE", 8),
+}
+
+
+# Self-pace Sheets traffic below Google's per-user quotas (100 reads per
+# 100 s, 60 writes per minute) so bursts queue briefly here instead of
+# turning into 429 storms. Limits leave some headroom under the caps.
+sheets_limiter = AsyncLimiter(90, 100)
+writes_limiter = AsyncLimiter(55, 60)
+
+
+# Transient 429s (quota) and 5xx responses from the Sheets API are common
+# enough that they shouldn't surface as user-facing errors.
+_RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+
+def _is_retryable(exc):
+    return isinstance(exc, HttpError) and exc.resp.status in _RETRYABLE_STATUSES
+
+
+@retry(
+    retry=retry_if_exception(_is_retryable),
+    wait=wait_exponential_jitter(initial=0.5, max=8),
+    stop=stop_after_attempt(5),
+    reraise=True,
+)
+def _execute(request):
+    """Execute a Sheets API request, retrying transient failures with backoff."""
+    return request.execute()
+
+
+# In-process TTL cache so hot reads (menu requests) don't hit the Sheets API
+# every time. Sheets allows ~60 reads/min/user, so without this every webhook
+# burns quota and waits on 1-2 network round-trips.
+CACHE_TTL_SECONDS = 60
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _cached(key, loader):
+    """
+    Return the cached value for `key`, calling `loader()` on a miss.
+
+    The lock is held across the load so concurrent misses don't stampede
+    the Sheets API with duplicate requests.
+    """
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None and entry[1] > time.monotonic():
+            return entry[0]
+
+        value = loader()
+        _cache[key] = (value, time.monotonic() + CACHE_TTL_SECONDS)
+        return value
+
+
+def flush_cache():
+    with _cache_lock:
+        _cache.clear()
+
+
+# Parse the service-account JSON once instead of on every call.
+_CREDENTIALS_INFO = orjson.loads(SERVICE_ACCOUNT_JSON) if SERVICE_ACCOUNT_JSON else None
+
+# build() fetches and parses the discovery document, which is expensive;
+# construct the client once and reuse it across all Sheets calls.
+_sheets_service = None
+_credentials = None
+_service_lock = threading.Lock()
+
+# httplib2 keeps the TLS connection to sheets.googleapis.com alive between
+# requests, but its Http object is not thread-safe. Give each executor
+# thread its own AuthorizedHttp so calls skip the TCP/TLS handshake after
+# the first without sharing connections across threads.
+_thread_http = threading.local()
+
+
+def _build_request(http, *args, **kwargs):
+    authed_http = getattr(_thread_http, "authed_http", None)
+    if authed_http is None:
+        authed_http = AuthorizedHttp(_credentials, http=httplib2.Http(timeout=30))
+        _thread_http.authed_http = authed_http
+    return HttpRequest(authed_http, *args, **kwargs)
+
+
 def get_sheets_service():
+    global _sheets_service, _credentials
+
+    if _sheets_service is not None:
+        return _sheets_service
+
     if not SERVICE_ACCOUNT_JSON:
         raise RuntimeError("Missing GOOGLE_SERVICE_ACCOUNT_JSON env var.")
     if not SPREADSHEET_ID:
         raise RuntimeError("Missing GOOGLE_SHEETS_SPREADSHEET_ID env var.")
 
-    credentials_info = json.loads(SERVICE_ACCOUNT_JSON)
-    credentials = service_account.Credentials.from_service_account_info(
-        credentials_info,
-        scopes=["https://www.googleapis.com/auth/spreadsheets"],
-    )
-    service = build("sheets", "v4", credentials=credentials)
-    return service
+    with _service_lock:
+        if _sheets_service is None:
+            _credentials = service_account.Credentials.from_service_account_info(
+                _CREDENTIALS_INFO,
+                scopes=["https://www.googleapis.com/auth/spreadsheets"],
+            )
+            _sheets_service = build(
+                "sheets",
+                "v4",
+                http=httplib2.Http(timeout=30),
+                requestBuilder=_build_request,
+                cache_discovery=False,
+                static_discovery=True,
+            )
+    return _sheets_service
 
 
 def get_business_config():
-    service = get_sheets_service()
-    result = (
-        service.spreadsheets()
-        .values()
-        .get(spreadsheetId=SPREADSHEET_ID, range="BusinessConfig!A2:F2")
-        .execute()
-    )
+    return CONFIG
 
-    values = result.get("values", [])
-    if not values:
-        return None
 
-    row = values[0]
-    # Ensure row has at least 6 columns
-    while len(row) < 6:
-        row.append("")
+def get_products():
+    return get_products_bundle()["list"]
 
-    menu_page_size = 8
-    try:
-        menu_page_size = int(row[5]) if row[5] else 8
-    except ValueError:
-        menu_page_size = 8
-
-    return {
-        "business_name": row[0],
-        "order_mode": (row[1] or "").strip().lower(),  # pickup / delivery / both
-        "currency_symbol": row[2] or "$",
-        "hours": row[3] or "",
-        "address": row[4] or "",
-        "menu_page_size": menu_page_size,
-    }
 
+def get_products_bundle():
+    return _cached("products", _load_products_bundle)
 
-def get_products():
+
+def get_config_and_products():
+    return CONFIG, get_products_bundle()
+
+
+async def fetch_config_and_products():
+    """
+    Async wrapper: run the (possibly blocking) cached loader in a worker
+    thread so concurrent webhooks aren't serialized behind the event loop.
+
+    Cache hits return immediately; only a miss (an actual Sheets read)
+    takes a slot from the rate limiter.
+    """
+    # Lock-free read: _cached holds _cache_lock across the Sheets load, so
+    # taking it here would stall the event loop for the whole fetch. A
+    # plain dict read is atomic in CPython, and a stale glimpse just sends
+    # us down the (lock-guarded) miss path.
+    entry = _cache.get("products")
+    if entry is not None and entry[1] > time.monotonic():
+        return CONFIG, entry[0]
+
+    async with sheets_limiter:
+        loop = asyncio.get_running_loop()
+        return CONFIG, await loop.run_in_executor(None, get_products_bundle)
+
+
+def _load_products_bundle():
     service = get_sheets_service()
-    result = (
+    result = _execute(
         service.spreadsheets()
         .values()
         .get(spreadsheetId=SPREADSHEET_ID, range="Products!A2:H")
-        .execute()
     )
 
-    rows = result.get("values", [])
+    products = _decode_products(result.get("values", []))
+
+    # Precompute what the hot paths need so each request is a dict lookup
+    # (orders) or a single prebuilt string (menu) instead of per-request
+    # scanning and formatting.
+    bundle = {
+        "list": products,
+        "by_number": {p["number"]: p for p in products},
+        "menu_text": _render_menu(products, CONFIG),
+    }
+
+    return bundle
+
+
+def _render_menu(products, config):
+    lines = "\n".join(
+        f"- {p['name']} — {config['currency_symbol']}{p['price']}" for p in products
+    )
+    return (
+        f"👋 Hola, bienvenido a {config['business_name']}.\n\n"
+        "Esto es lo que tenemos hoy:\n\n"
+        f"{lines}\n\n"
+        "Para ordenar, escribe por ejemplo: 2001 x 2"
+    )
+
+
+def _decode_products(rows):
     products = []
 
     for row in rows:
@@ -114,29 +274,210 @@ def get_products():
     return products
 
 
-def save_order(phone, items, total):
+def order_timestamp():
+    """
+    One clock read per order: the id is the epoch second (keep it simple
+    for MVP) and the ISO timestamp is derived from the same instant.
+    """
+    now_ns = time.time_ns()
+    order_id = str(now_ns // 1_000_000_000)
+    now_iso = datetime.fromtimestamp(now_ns / 1e9, tz=timezone.utc).isoformat()
+    return order_id, now_iso
+
+
+# Pending order rows are buffered and appended in batches: one Sheets
+# append per flush instead of one per order, which keeps bursty traffic
+# well under the 60 writes/min quota.
+FLUSH_INTERVAL_SECONDS = 2
+FLUSH_MAX_ROWS = 50
+
+_pending_orders = None
+_flusher_task = None
+
+
+async def save_order(order_id, phone, items, total, now):
+    row = [
+        order_id,
+        phone,
+        orjson.dumps(items).decode(),  # Sheets expects a str cell value
+        total,
+        "new",
+        "",  # order_type (pickup/delivery) later
+        "",  # address later
+        now,
+    ]
+    # Queue items are (row, attempts) so a failed batch gets exactly one
+    # more trip through the flusher before being reported as lost.
+    await _pending_orders.put((row, 0))
+
+
+# Queued at shutdown so the flusher flushes its current batch and exits
+# on its own, instead of being cancelled with collected rows in hand.
+_SHUTDOWN = object()
+
+
+async def _order_flusher():
+    loop = asyncio.get_running_loop()
+    shutting_down = False
+
+    while not shutting_down:
+        # Block until at least one order arrives, then keep collecting
+        # until the batch is full or the flush interval elapses.
+        first = await _pending_orders.get()
+        if first is _SHUTDOWN:
+            return
+        batch = [first]
+        deadline = loop.time() + FLUSH_INTERVAL_SECONDS
+
+        while len(batch) < FLUSH_MAX_ROWS:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(_pending_orders.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if item is _SHUTDOWN:
+                shutting_down = True
+                break
+            batch.append(item)
+
+        try:
+            async with writes_limiter:
+                rows = [row for row, _ in batch]
+                await loop.run_in_executor(None, _append_order_rows, rows)
+        except Exception:
+            # _append_order_rows already retried; don't let one bad batch
+            # kill the flusher.
+            _handle_flush_failure(batch)
+
+
+def _handle_flush_failure(batch):
+    """
+    A batch failed even after _execute's retries. These orders were
+    already confirmed to users, so losing them silently is not an option:
+    each row gets one more trip through the queue, and rows that already
+    had their second chance are dumped to stderr for manual re-entry.
+    """
+    traceback.print_exc(file=sys.stderr)
+
+    dropped = []
+    for row, attempts in batch:
+        if attempts == 0:
+            _pending_orders.put_nowait((row, 1))
+        else:
+            dropped.append(row)
+
+    if dropped:
+        _report_dropped_rows(dropped)
+
+
+def _report_dropped_rows(rows):
+    print(
+        f"ERROR: dropping {len(rows)} order row(s) after repeated append "
+        f"failures: {rows!r}",
+        file=sys.stderr,
+        flush=True,
+    )
+
+
+def _drain_pending():
+    rows = []
+    while _pending_orders is not None and not _pending_orders.empty():
+        item = _pending_orders.get_nowait()
+        if item is not _SHUTDOWN:
+            rows.append(item[0])
+    return rows
+
+
+# Refresh just under the TTL so webhooks always hit a warm cache instead
+# of blocking on (or stampeding) a cold reload.
+REFRESH_INTERVAL_SECONDS = 55
+
+_refresh_task = None
+
+
+async def _periodic_refresh():
+    loop = asyncio.get_running_loop()
+
+    while True:
+        await asyncio.sleep(REFRESH_INTERVAL_SECONDS)
+        try:
+            async with sheets_limiter:
+                bundle = await loop.run_in_executor(None, _load_products_bundle)
+            # Plain assignment (atomic) - see fetch_config_and_products for
+            # why the lock must not be taken on the event loop.
+            _cache["products"] = (bundle, time.monotonic() + CACHE_TTL_SECONDS)
+        except Exception:
+            # Keep serving the current entry; the next cycle retries.
+            pass
+
+
+@app.on_event("startup")
+async def _warmup():
+    global _refresh_task
+
+    # Pay the discovery + JWT + first-fetch cost here instead of on the
+    # first user's webhook (matters on autoscaled deploys).
+    try:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, get_sheets_service)
+        await fetch_config_and_products()
+    except Exception:
+        # Missing or bad credentials shouldn't stop the app from booting;
+        # the first webhook will retry and surface the error.
+        pass
+
+    _refresh_task = asyncio.create_task(_periodic_refresh())
+
+
+@app.on_event("shutdown")
+async def _stop_refresh():
+    if _refresh_task is not None:
+        _refresh_task.cancel()
+        try:
+            await _refresh_task
+        except asyncio.CancelledError:
+            pass
+
+
+@app.on_event("startup")
+async def _start_order_flusher():
+    global _pending_orders, _flusher_task
+    _pending_orders = asyncio.Queue()
+    _flusher_task = asyncio.create_task(_order_flusher())
+
+
+@app.on_event("shutdown")
+async def _stop_order_flusher():
+    if _flusher_task is not None:
+        # Cancelling mid-batch would drop rows the flusher had already
+        # collected (and whose orders were confirmed to users); the
+        # sentinel lets it flush what it holds and exit cleanly.
+        await _pending_orders.put(_SHUTDOWN)
+        await _flusher_task
+
+    # Don't lose orders that were still buffered.
+    rows = _drain_pending()
+    if rows:
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, _append_order_rows, rows)
+        except Exception:
+            traceback.print_exc(file=sys.stderr)
+            _report_dropped_rows(rows)
+
+
+def _append_order_rows(rows):
+    """
+    Append a batch of order rows to the Orders sheet in one call. Runs off
+    the response path, so a couple of quick retries won't delay anyone.
+    """
     service = get_sheets_service()
-    now = datetime.utcnow().isoformat()
-
-    # Keep it simple for MVP
-    order_id = str(int(datetime.utcnow().timestamp()))
-
-    body = {
-        "values": [
-            [
-                order_id,
-                phone,
-                json.dumps(items, ensure_ascii=False),
-                total,
-                "new",
-                "",  # order_type (pickup/delivery) later
-                "",  # address later
-                now,
-            ]
-        ]
-    }
 
-    (
+    body = {"values": rows}
+
+    _execute(
         service.spreadsheets()
         .values()
         .append(
@@ -145,24 +486,66 @@ def save_order(phone, items, total):
             valueInputOption="RAW",
             body=body,
         )
-        .execute()
     )
 
-    return order_id
-
 
 @app.get("/health")
 def health():
     return {"status": "ok"}
 
 
+@app.post("/admin/cache/flush")
+def admin_cache_flush():
+    """
+    Invalidate the in-memory cache after editing the sheet, so changes
+    show up before the TTL expires.
+    """
+    flush_cache()
+    return {"status": "flushed"}
+
+
+def _twiml_document(msg: str) -> bytes:
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        f"<Response><Message>{escape(msg)}</Message></Response>"
+    ).encode("utf-8")
+
+
 def twiml_response(msg: str) -> Response:
     """
     Return proper TwiML XML so WhatsApp doesn't show the XML tags.
+
+    Plain string formatting instead of twilio's MessagingResponse DOM -
+    same document, no per-request object tree and serialization.
     """
-    tw = MessagingResponse()
-    tw.message(msg)
-    return Response(content=str(tw), media_type="application/xml")
+    return Response(content=_twiml_document(msg), media_type="application/xml")
+
+
+# Replies that never change, rendered once at import. Starlette responses
+# are immutable after construction, so the same instance can be returned
+# for every request.
+_TW_CONFIG_ERROR = twiml_response(
+    "⚠️ Error de configuración del negocio. Revisa las variables de entorno."
+)
+_TW_NO_PRODUCTS = twiml_response("⚠️ No hay productos activos en la hoja Products.")
+_TW_QTY_HINT = twiml_response("La cantidad debe ser mayor a 0. Ejemplo: 2001 x 2")
+_TW_NOT_FOUND = twiml_response("Producto no encontrado. Escribe MENU para ver opciones.")
+_TW_ORDER_ERROR = twiml_response(
+    "Ocurrió un error procesando tu pedido. Intenta de nuevo."
+)
+_TW_INVALID_FORMAT = twiml_response("Formato inválido. Usa: 2001 x 2")
+_TW_MENU_HINT = twiml_response(
+    "Escribe MENU para ver opciones, o envía tu pedido (ej: 2001 x 2)."
+)
+
+
+# Intent patterns, compiled once: a single scan instead of a chain of
+# substring checks per message.
+_MENU_RE = re.compile(
+    r"\b(hola|buen[oa]s(?: (?:d[ií]as|tardes|noches))?|men[uú]|qu[eé] venden)\b",
+    re.IGNORECASE,
+)
+_ORDER_RE = re.compile(r"^\s*(\d+)\s*x\s*(\d+)\s*$")
 
 
 @app.post("/webhook/twilio")
@@ -171,47 +554,33 @@ async def whatsapp_webhook(request: Request):
     incoming_msg = (form.get("Body") or "").strip().lower()
     phone = form.get("From") or ""
 
-    # Load config
-    config = get_business_config()
-    if not config:
-        return twiml_response("⚠️ Error de configuración del negocio. Revisa BusinessConfig.")
+    # Config comes from env; products from the (cached) Sheets read
+    config, bundle = await fetch_config_and_products()
+    if not config["business_name"]:
+        return _TW_CONFIG_ERROR
 
     # Basic intents
-    if (
-        incoming_msg in ["hola", "buenas", "buenos dias", "buenas tardes", "buenas noches"]
-        or "menu" in incoming_msg
-        or "qué venden" in incoming_msg
-        or "que venden" in incoming_msg
-    ):
-        products = get_products()
-        if not products:
-            return twiml_response("⚠️ No hay productos activos en la hoja Products.")
-
-        # Simple conversational menu (no XML visible now)
-        text = f"👋 Hola, bienvenido a {config['business_name']}.\n\n"
-        text += "Esto es lo que tenemos hoy:\n\n"
-
-        for p in products:
-            text += f"- {p['name']} — {config['currency_symbol']}{p['price']}\n"
-
-        text += "\nPara ordenar, escribe por ejemplo: 2001 x 2"
-        return twiml_response(text)
+    if _MENU_RE.search(incoming_msg):
+        if not bundle["list"]:
+            return _TW_NO_PRODUCTS
+
+        # Menu text is prebuilt on cache refresh (no XML visible now)
+        return twiml_response(bundle["menu_text"])
 
     # Simple order format: "2001 x 2"
-    if "x" in incoming_msg:
+    order_match = _ORDER_RE.match(incoming_msg)
+    if order_match:
         try:
-            left, right = incoming_msg.split("x", 1)
-            number = left.strip()
-            qty = int(right.strip())
+            number = order_match.group(1)
+            qty = int(order_match.group(2))
 
             if qty <= 0:
-                return twiml_response("La cantidad debe ser mayor a 0. Ejemplo: 2001 x 2")
+                return _TW_QTY_HINT
 
-            products = get_products()
-            selected = next((p for p in products if p["number"] == number), None)
+            selected = bundle["by_number"].get(number)
 
             if not selected:
-                return twiml_response("Producto no encontrado. Escribe MENU para ver opciones.")
+                return _TW_NOT_FOUND
 
             total = selected["price"] * qty
             items = [
@@ -223,7 +592,10 @@ async def whatsapp_webhook(request: Request):
                 }
             ]
 
-            order_id = save_order(phone, items, total)
+            # Generate the ID now so we can confirm immediately; the row is
+            # buffered and appended by the background flusher.
+            order_id, now = order_timestamp()
+            await save_order(order_id, phone, items, total, now)
 
             msg = (
                 f"✅ ¡Pedido recibido!\n"
@@ -234,9 +606,10 @@ async def whatsapp_webhook(request: Request):
             )
             return twiml_response(msg)
 
-        except ValueError:
-            return twiml_response("Formato inválido. Usa: 2001 x 2")
         except Exception:
-            return twiml_response("Ocurrió un error procesando tu pedido. Intenta de nuevo.")
+            return _TW_ORDER_ERROR
+
+    if "x" in incoming_msg:
+        return _TW_INVALID_FORMAT
 
-    return twiml_response("Escribe MENU para ver opciones, o envía tu pedido (ej: 2001 x 2).")
+    return _TW_MENU_HINT
@@ -0,0 +1,8 @@
+from app.main import app
+
+
+def test_no_duplicate_routes():
+    # A duplicated module body (copy-pasted definitions) would register
+    # the same paths twice; the last registration silently wins.
+    paths = [route.path for route in app.routes]
+    assert len(set(paths)) == len(paths)